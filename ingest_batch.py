@@ -0,0 +1,269 @@
+import os
+import time
+from hashlib import blake2b
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import orjson
+from dotenv import load_dotenv
+from openai import OpenAI
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+from ingest_to_vectordb import (
+    CHROMA_DB_DIR,
+    COLLECTION_NAME,
+    EMBEDDING_MODEL,
+    JSONL_FILE,
+    document_generator,
+    is_legacy_collection,
+)
+
+load_dotenv()  # Load environment variables from .env file
+
+# Configuration
+BATCH_INPUT_PREFIX = "embedding_batch_input"
+BATCH_OUTPUT_FILE = "embedding_batch_output.jsonl"
+BATCH_STATE_FILE = "embedding_batches.json"  # Batch ids and chunk fingerprints, allows resuming a run
+REQUEST_SIZE = 100  # Documents embedded per request line
+MAX_INPUTS_PER_BATCH = 50000  # OpenAI limit on embedding inputs per batch job
+POLL_INTERVAL = 60  # Seconds between status checks
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+Record = Tuple[str, str, Dict[str, Any]]
+State = Dict[str, Any]
+
+def chunked(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    """Groups (id, page_content, metadata) records into lists of at most `size` items."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def chunk_digest(chunk: List[Record]) -> str:
+    """Fingerprints a chunk's ids, contents and metadata."""
+    h = blake2b(digest_size=16)
+    for record in chunk:
+        h.update(orjson.dumps(record))
+    return h.hexdigest()
+
+def write_batch_inputs() -> Tuple[List[str], List[str]]:
+    """
+    Writes the embedding requests for every document to JSONL files,
+    starting a new file whenever a batch job would exceed its input limit.
+    Request i covers the i-th chunk of REQUEST_SIZE documents; the chunk
+    fingerprints returned alongside the paths are checked before results
+    are matched back to the re-read documents.
+    """
+    paths = []
+    digests = []
+    out_f = None
+    inputs_in_file = MAX_INPUTS_PER_BATCH
+    try:
+        for i, chunk in enumerate(chunked(document_generator(JSONL_FILE), REQUEST_SIZE)):
+            if inputs_in_file + len(chunk) > MAX_INPUTS_PER_BATCH:
+                if out_f:
+                    out_f.close()
+                path = f"{BATCH_INPUT_PREFIX}_{len(paths)}.jsonl"
+                out_f = open(path, "wb")
+                paths.append(path)
+                inputs_in_file = 0
+
+            request = {
+                "custom_id": f"chunk-{i}",
+                "method": "POST",
+                "url": "/v1/embeddings",
+                "body": {"model": EMBEDDING_MODEL, "input": [page_content for _, page_content, _ in chunk]},
+            }
+            out_f.write(orjson.dumps(request, option=orjson.OPT_APPEND_NEWLINE))
+            digests.append(chunk_digest(chunk))
+            inputs_in_file += len(chunk)
+    finally:
+        if out_f:
+            out_f.close()
+    return paths, digests
+
+def submit_batch(client: OpenAI, path: str) -> str:
+    """Uploads an input file and starts a batch job for it."""
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/embeddings",
+        completion_window="24h",
+    )
+    print(f"Submitted {path} as batch {batch.id}")
+    return batch.id
+
+def load_state() -> State:
+    """Loads the batch state saved by a previous run."""
+    with open(BATCH_STATE_FILE, "rb") as f:
+        return orjson.loads(f.read())
+
+def save_state(state: State) -> None:
+    """
+    Records each input file's batch id, where None marks a file still to be
+    submitted, and the fingerprint of every submitted chunk.
+    """
+    with open(BATCH_STATE_FILE, "wb") as f:
+        f.write(orjson.dumps(state))
+
+def wait_for_batch(client: OpenAI, batch_id: str):
+    """Polls a batch job until it reaches a terminal status."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} requests)" if counts else ""
+        print(f"Batch {batch_id} is {batch.status}{progress}, checking again in {POLL_INTERVAL}s...")
+        time.sleep(POLL_INTERVAL)
+
+def download_results(client: OpenAI, file_id: str, out_f) -> None:
+    """
+    Streams a results file to disk in chunks rather than loading it whole,
+    making sure it ends in a newline before the next file is appended.
+    """
+    last_byte = b"\n"
+    with client.files.with_streaming_response.content(file_id) as response:
+        for data in response.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if data:
+                out_f.write(data)
+                last_byte = data[-1:]
+    if last_byte != b"\n":
+        out_f.write(b"\n")
+
+def index_results(path: str) -> Dict[str, int]:
+    """
+    Maps each custom_id to the byte offset of its line in the results file,
+    so embeddings are loaded one request at a time instead of all at once.
+    """
+    offsets = {}
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.isspace():
+                offsets[orjson.loads(line)["custom_id"]] = offset
+            offset += len(line)
+    return offsets
+
+def load_embeddings(f, offset: int) -> Optional[List[List[float]]]:
+    """Reads one result line and returns its embeddings in input order."""
+    f.seek(offset)
+    result = orjson.loads(f.readline())
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        print(f"Request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+        return None
+    data = sorted(response["body"]["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data]
+
+def find_changed_chunk(expected: List[str]) -> Optional[int]:
+    """
+    Re-reads the documents and returns the index of the first chunk that
+    differs from what was submitted, or None when all of them match.
+    """
+    i = -1
+    for i, chunk in enumerate(chunked(document_generator(JSONL_FILE), REQUEST_SIZE)):
+        if i >= len(expected) or chunk_digest(chunk) != expected[i]:
+            return i
+    return None if i + 1 == len(expected) else i + 1
+
+def main():
+    # Check for API Key
+    if not os.environ.get("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY environment variable not set.")
+        return
+
+    client = OpenAI()
+
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+
+    print(f"Initializing ChromaDB at {CHROMA_DB_DIR}...")
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=CHROMA_DB_DIR
+    )
+
+    # Checked before submitting, so no batch is paid for that would only duplicate documents
+    if is_legacy_collection(vectorstore):
+        print(f"Error: {CHROMA_DB_DIR} was built by an older version that used random ids. "
+              f"Delete the folder once and re-run to rebuild it.")
+        return
+
+    # 1. Prepare & Submit (or resume a previous submission)
+    if os.path.exists(BATCH_STATE_FILE):
+        state = load_state()
+        print(f"Resuming {len(state['batches'])} batches from {BATCH_STATE_FILE}...")
+    else:
+        paths, digests = write_batch_inputs()
+        state = {"batches": {path: None for path in paths}, "chunks": digests}
+    batches = state["batches"]
+
+    for path, batch_id in batches.items():
+        if batch_id is None:
+            if not os.path.exists(path):
+                print(f"Error: input file {path} is missing. Delete {BATCH_STATE_FILE} to start over.")
+                return
+            batches[path] = submit_batch(client, path)
+            save_state(state)  # Saved per submission so no paid batch is forgotten
+
+    # 2. Poll & Download Results
+    with open(BATCH_OUTPUT_FILE, "wb") as out_f:
+        for path, batch_id in batches.items():
+            batch = wait_for_batch(client, batch_id)
+            if batch.status != "completed" or not batch.output_file_id:
+                print(f"Error: batch {batch_id} for {path} ended with status '{batch.status}'.")
+                if batch.errors and batch.errors.data:
+                    for error in batch.errors.data:
+                        print(f"  {error.code}: {error.message}")
+                # Forget the dead batch so the next run resubmits only this file
+                batches[path] = None
+                save_state(state)
+                print(f"Re-run the script to resubmit {path}; completed batches are kept.")
+                return
+            download_results(client, batch.output_file_id, out_f)
+
+    # 3. Store Precomputed Embeddings (Stream Processing)
+    # Results are matched to documents by position, so refuse if the JSONL changed since submission
+    changed = find_changed_chunk(state["chunks"])
+    if changed is not None:
+        print(f"Error: {JSONL_FILE} has changed since the batches were submitted (first at chunk {changed}), "
+              f"so the results no longer line up with the documents. Restore the file, "
+              f"or delete {BATCH_STATE_FILE} and re-run to resubmit.")
+        return
+
+    offsets = index_results(BATCH_OUTPUT_FILE)
+    total_count = 0
+    fallback_count = 0
+    with open(BATCH_OUTPUT_FILE, "rb") as results:
+        # The JSONL is re-read in the same order it was submitted in
+        for i, chunk in enumerate(chunked(document_generator(JSONL_FILE), REQUEST_SIZE)):
+            offset = offsets.get(f"chunk-{i}")
+            vectors = load_embeddings(results, offset) if offset is not None else None
+            if vectors is None or len(vectors) != len(chunk):
+                # Re-embed at the regular price; OpenAIEmbeddings splits inputs over the token limit
+                print(f"Re-embedding chunk {i} without the Batch API...")
+                vectors = embeddings.embed_documents([page_content for _, page_content, _ in chunk])
+                fallback_count += len(chunk)
+
+            ids, page_contents, metadatas = map(list, zip(*chunk))
+            vectorstore._collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                metadatas=metadatas,
+                documents=page_contents,
+            )
+            total_count += len(ids)
+            print(f"Ingested {total_count} documents...")
+
+    os.remove(BATCH_STATE_FILE)
+    if fallback_count:
+        print(f"{fallback_count} documents were re-embedded outside the batch.")
+    print(f"Ingestion complete. Total documents: {total_count}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
-import json
 import os
-from typing import Iterator, Dict, Any
+import pickle
+import random
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from hashlib import blake2b
+from typing import Container, Iterable, Iterator, Dict, Any, List, Set, Tuple
+import orjson
 from dotenv import load_dotenv
+from openai import RateLimitError
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.documents import Document
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -12,98 +18,209 @@ load_dotenv()  # Load environment variables from .env file
 JSONL_FILE = "parsed_blender_api.jsonl"
 CHROMA_DB_DIR = "./chroma_db"
 COLLECTION_NAME = "blender_api"
-BATCH_SIZE = 1000
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_FILE = f"embedding_cache_{EMBEDDING_MODEL}.pkl"  # content hash -> embedding
+MAX_EMBEDDING_INPUTS = 2048  # OpenAI limit on inputs per embeddings request
+MAX_WORKERS = 8  # Concurrent embedding requests
+MAX_RETRIES = 5  # Attempts per batch when rate limited
+READ_BUFFER_SIZE = 1 << 20  # 1 MiB; fewer read() syscalls on large JSONL files
 
 def create_rich_text(entry: Dict[str, Any]) -> str:
     """
     Constructs a comprehensive Markdown string for embedding.
     Markdown structure helps LLMs understand the context better.
     """
-    # 1. Header & Identity
-    parts = [
-        f"# API Reference: {entry.get('id', 'N/A')}",
-        f"- Type: {entry.get('type', 'N/A')}",
-        f"- Name: {entry.get('name', 'N/A')}",
-    ]
-    
-    # 2. Description
-    if entry.get('description'):
-        parts.append(f"\n## Description\n{entry['description']}")
+    get = entry.get
+    description = get('description')
+    signature = get('signature')
+    params = get('parameters')
+    return_type = get('return_type')
+    examples = get('code_examples')
 
-    # 3. Signature (Code Block)
-    if entry.get('signature'):
-        parts.append(f"\n## Signature\n```python\n{entry['signature']}\n```")
-    
-    # 4. Parameters
-    if entry.get('parameters'):
-        params = entry['parameters']
-        parts.append("\n## Parameters")
-        if isinstance(params, list):
-            for p in params:
-                parts.append(f"- {p}")
-        else:
-            parts.append(f"- {params}")
-
-    # 5. Return Type
-    if entry.get('return_type'):
-        parts.append(f"\n## Return Type\n- {entry['return_type']}")
-        
-    # 6. Code Examples (High Priority for RAG)
-    if entry.get('code_examples'):
-        examples = entry['code_examples']
-        parts.append("\n## Example Code")
-        if isinstance(examples, list):
-            for ex in examples:
-                parts.append(f"```python\n{ex}\n```")
-        else:
-            parts.append(f"```python\n{examples}\n```")
-        
-    return "\n".join(parts)
-
-def document_generator(file_path: str) -> Iterator[Document]:
+    parameters_md = ""
+    if params:
+        items = params if isinstance(params, list) else [params]
+        parameters_md = "\n\n## Parameters\n" + "\n".join(f"- {p}" for p in items)
+
+    examples_md = ""
+    if examples:
+        items = examples if isinstance(examples, list) else [examples]
+        examples_md = "\n\n## Example Code\n" + "\n".join(f"```python\n{ex}\n```" for ex in items)
+
+    return "".join((
+        # 1. Header & Identity
+        f"# API Reference: {get('id', 'N/A')}\n- Type: {get('type', 'N/A')}\n- Name: {get('name', 'N/A')}",
+        # 2. Description
+        f"\n\n## Description\n{description}" if description else "",
+        # 3. Signature (Code Block)
+        f"\n\n## Signature\n```python\n{signature}\n```" if signature else "",
+        # 4. Parameters
+        parameters_md,
+        # 5. Return Type
+        f"\n\n## Return Type\n- {return_type}" if return_type else "",
+        # 6. Code Examples (High Priority for RAG)
+        examples_md,
+    ))
+
+def document_generator(
+    file_path: str,
+    skip_ids: Container[str] = (),
+) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
     """
     [Memory Optimization]
-    Yields documents one by one using a generator.
+    Yields (id, page_content, metadata) records one by one using a generator.
     Never loads the entire dataset into memory at once.
+    Entries whose id is in skip_ids are dropped before any text is built.
+    Only the first entry for each id is kept; the parser does not
+    de-duplicate ids across pages, and Chroma rejects a repeated id within
+    an upsert. Dropping repeats here keeps the result independent of which
+    concurrent batch finishes last, and keeps the stored count exact.
     """
     print(f"Reading {file_path}...")
-    with open(file_path, 'r', encoding='utf-8') as f:
+    seen_ids = set()
+    # orjson decodes UTF-8 bytes directly, so skip text-mode decoding entirely
+    with open(file_path, 'rb', buffering=READ_BUFFER_SIZE) as f:
         for i, line in enumerate(f):
-            if not line.strip():
+            if line.isspace():
                 continue
             
             try:
-                entry = json.loads(line)
+                entry = orjson.loads(line)
                 
+                get = entry.get
+
                 # Create Metadata
                 # Improved module extraction logic
-                api_id = str(entry.get("id", ""))
-                module_name = "unknown"
-                if api_id:
-                    parts_split = api_id.split(".")
-                    # Extract 'bpy.ops' or 'bmesh.ops' instead of just 'bpy'
-                    if len(parts_split) >= 2:
-                        module_name = f"{parts_split[0]}.{parts_split[1]}"
-                    else:
-                        module_name = parts_split[0]
+                api_id = str(get("id", ""))
+                if api_id in skip_ids:
+                    continue
+                if api_id in seen_ids:
+                    print(f"Skipping duplicate id {api_id} on line {i+1}")
+                    continue
+                seen_ids.add(api_id)
+
+                # Extract 'bpy.ops' or 'bmesh.ops' instead of just 'bpy'
+                module_name = ".".join(api_id.split(".", 2)[:2]) if api_id else "unknown"
 
                 metadata = {
                     "id": api_id,
-                    "type": str(entry.get("type", "")),
-                    "name": str(entry.get("name", "")),
+                    "type": str(get("type", "")),
+                    "name": str(get("name", "")),
                     "module": module_name,
-                    "url": str(entry.get("url", "")), # Parsed URL with anchor
-                    "has_code": bool(entry.get("code_examples")),
+                    "url": str(get("url", "")), # Parsed URL with anchor
+                    "has_code": bool(get("code_examples")),
                 }
                 
                 # Create Page Content
                 page_content = create_rich_text(entry)
                 
-                yield Document(page_content=page_content, metadata=metadata)
+                yield api_id, page_content, metadata
                 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 print(f"Error parsing line {i+1}: {e}")
 
+def is_legacy_collection(vectorstore: Chroma) -> bool:
+    """
+    Detects a collection built before records were keyed by API id, when
+    LangChain stored them under random UUIDs with the API id only in metadata.
+    """
+    sample = vectorstore._collection.get(limit=1, include=["metadatas"])
+    if not sample["ids"]:
+        return False
+    metadata = sample["metadatas"][0] or {}
+    return sample["ids"][0] != metadata.get("id")
+
+def fetch_existing_ids(vectorstore: Chroma, page_size: int) -> Set[str]:
+    """Collects the ids already stored in the collection, one page at a time."""
+    existing = set()
+    offset = 0
+    while True:
+        ids = vectorstore._collection.get(include=[], limit=page_size, offset=offset)["ids"]
+        existing.update(ids)
+        if len(ids) < page_size:
+            return existing
+        offset += page_size
+
+def load_embedding_cache() -> Dict[bytes, array]:
+    """Loads the embeddings persisted by previous runs, if any."""
+    if not os.path.exists(EMBEDDING_CACHE_FILE):
+        return {}
+    try:
+        with open(EMBEDDING_CACHE_FILE, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Warning: ignoring unreadable {EMBEDDING_CACHE_FILE} ({e}); starting with an empty cache.")
+        return {}
+
+def save_embedding_cache(cache: Dict[bytes, array]) -> None:
+    """
+    Persists the embeddings so later runs can skip unchanged contents.
+    Written to a temporary file first, so an interrupted save leaves the
+    previous cache intact.
+    """
+    tmp_path = f"{EMBEDDING_CACHE_FILE}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, EMBEDDING_CACHE_FILE)
+
+def embed_unique(
+    embeddings: OpenAIEmbeddings,
+    page_contents: List[str],
+    cache: Dict[bytes, array],
+) -> List[List[float]]:
+    """
+    Embeds only contents missing from the persistent cache, keyed by a hash
+    of the text. Every content starts with its unique API id, so nothing is
+    shared within a run; the cache pays off when a deleted collection is
+    rebuilt from an unchanged or lightly edited JSONL.
+    """
+    keys = [blake2b(content.encode(), digest_size=16).digest() for content in page_contents]
+    missing = {key: content for key, content in zip(keys, page_contents) if key not in cache}
+
+    if missing:
+        vectors = embeddings.embed_documents(list(missing.values()))
+        for key, vector in zip(missing, vectors):
+            cache[key] = array("f", vector)  # float32, as Chroma stores them
+
+    return [cache[key].tolist() for key in keys]
+
+def ingest_batch(
+    vectorstore: Chroma,
+    embeddings: OpenAIEmbeddings,
+    cache: Dict[bytes, array],
+    ids: List[str],
+    page_contents: List[str],
+    metadatas: List[Dict[str, Any]],
+) -> int:
+    """
+    Embeds one batch with a single call and upserts it straight into the
+    Chroma collection, backing off exponentially when rate limited.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            vectors = embed_unique(embeddings, page_contents, cache)
+            vectorstore._collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                metadatas=metadatas,
+                documents=page_contents,
+            )
+            return len(ids)
+        except RateLimitError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt + random.random())
+
+def collect_results(futures: Iterable[Future], total_count: int) -> int:
+    """Reports finished batches and returns the updated document count."""
+    for future in futures:
+        try:
+            total_count += future.result()
+            print(f"Ingested {total_count} documents...")
+        except Exception as e:
+            print(f"Error ingesting batch at count {total_count}: {e}")
+    return total_count
+
 def main():
     # Check for API Key
     if not os.environ.get("OPENAI_API_KEY"):
@@ -112,7 +229,7 @@ def main():
 
     # Initialize Embeddings
     print("Initializing OpenAI Embeddings...")
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
 
     # Initialize VectorDB (Persistent Client)
     print(f"Initializing ChromaDB at {CHROMA_DB_DIR}...")
@@ -122,35 +239,61 @@ def main():
         persist_directory=CHROMA_DB_DIR
     )
 
+    # Old collections use random ids; upserting by API id would duplicate every document
+    if is_legacy_collection(vectorstore):
+        print(f"Error: {CHROMA_DB_DIR} was built by an older version that used random ids. "
+              f"Delete the folder once and re-run to rebuild it.")
+        return
+
+    # Size batches to what both Chroma's backend and the embeddings endpoint accept
+    batch_size = min(vectorstore._client.get_max_batch_size(), MAX_EMBEDDING_INPUTS)
+    print(f"Using batch size {batch_size}.")
+
+    # Skip entries ingested by a previous run (idempotent re-runs)
+    existing_ids = fetch_existing_ids(vectorstore, batch_size)
+    print(f"Found {len(existing_ids)} documents already in the collection.")
+
+    cache = load_embedding_cache()
+    cached_count = len(cache)
+    print(f"Loaded {cached_count} cached embeddings.")
+
     # Ingest in Batches (Stream Processing)
-    batch = []
+    # Embedding calls are network-bound, so several batches are kept in flight at once.
+    # Batches are kept as parallel lists, the layout Chroma takes them in.
+    ids, page_contents, metadatas = [], [], []
     total_count = 0
+    pending = set()
     
     print(f"Starting stream ingestion...")
     
-    for doc in document_generator(JSONL_FILE):
-        batch.append(doc)
-        
-        # When batch is full, push to DB and clear memory
-        if len(batch) >= BATCH_SIZE:
-            try:
-                vectorstore.add_documents(documents=batch)
-                total_count += len(batch)
-                print(f"Ingested {total_count} documents...")
-            except Exception as e:
-                print(f"Error ingesting batch at count {total_count}: {e}")
-            finally:
-                batch = [] # Critical: Clear memory
-
-    # Ingest remaining documents
-    if batch:
-        try:
-            vectorstore.add_documents(documents=batch)
-            total_count += len(batch)
-            print(f"Ingested remaining {len(batch)} documents.")
-        except Exception as e:
-            print(f"Error ingesting final batch: {e}")
+    # Saved even when a run is interrupted, so embeddings already paid for are kept
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for api_id, page_content, metadata in document_generator(JSONL_FILE, existing_ids):
+                ids.append(api_id)
+                page_contents.append(page_content)
+                metadatas.append(metadata)
+            
+                # When batch is full, push to DB and clear memory
+                if len(ids) >= batch_size:
+                    # Bound in-flight batches so memory stays flat while the reader runs ahead
+                    if len(pending) >= MAX_WORKERS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        total_count = collect_results(done, total_count)
+                    pending.add(executor.submit(ingest_batch, vectorstore, embeddings, cache, ids, page_contents, metadatas))
+                    ids, page_contents, metadatas = [], [], [] # Critical: Clear memory
+
+            # Ingest remaining documents
+            if ids:
+                pending.add(executor.submit(ingest_batch, vectorstore, embeddings, cache, ids, page_contents, metadatas))
 
+            done, _ = wait(pending)
+            total_count = collect_results(done, total_count)
+    finally:
+        # The cache only grows, so an unchanged size means there is nothing new to write
+        if len(cache) > cached_count:
+            save_embedding_cache(cache)
+            print(f"Saved {len(cache)} embeddings to {EMBEDDING_CACHE_FILE}.")
     print(f"Ingestion complete. Total documents: {total_count}")
 
 if __name__ == "__main__":
@@ -1,35 +1,76 @@
 import os
-import json
 import logging
 import re
-from bs4 import BeautifulSoup, NavigableString
+import orjson
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
+from itertools import chain
+from select_docs import SOURCE_DIR, is_relevant
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-SRC_DIR = "selected_blender_docs"
 OUTPUT_FILE = "parsed_blender_api.jsonl"
 
+# Only build the main content region; head/nav/footer are never used.
+MAIN_STRAINER = SoupStrainer(["article", "div"], attrs={"role": "main"})
+CANONICAL_RE = re.compile(r'<link\b[^>]*\brel=["\']canonical["\'][^>]*>', re.IGNORECASE)
+HREF_RE = re.compile(r'\bhref=["\']([^"\']*)["\']', re.IGNORECASE)
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+TEXT_TAGS = {'p', 'ul', 'ol', 'span'}
+WHITESPACE_RE = re.compile(r'\s+')
+
 def clean_text(text):
     if not text: return ""
-    return re.sub(r'\s+', ' ', text).strip()
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def collect_intro(dl):
+    """Collects the paragraphs and code blocks preceding dl in a single forward pass."""
+    intro_desc = []
+    intro_code = []
+    for sibling in dl.parent.children:
+        if sibling is dl:
+            break
+
+        tag_name = sibling.name
+        if tag_name in HEADING_TAGS or tag_name == 'dl':
+            # Only content after the last header/definition belongs to dl
+            intro_desc = []
+            intro_code = []
+
+        # Capture Description
+        elif tag_name == 'p':
+            text = clean_text(sibling.get_text())
+            if text: intro_desc.append(text)
+
+        # Capture Code
+        elif tag_name == 'div' and ('highlight' in sibling.get('class', []) or sibling.find('div', class_='highlight')):
+            intro_code.extend(pre.get_text() for pre in sibling.find_all('pre'))
+        elif tag_name == 'pre':
+            intro_code.append(sibling.get_text())
+
+    return intro_desc, intro_code
 
 def parse_html_file(file_path):
-    """Parses a single HTML file and yields extracted API entities."""
+    """Parses a single HTML file and returns the extracted API entities."""
     with open(file_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+        html = f.read()
+
+    soup = BeautifulSoup(html, "lxml", parse_only=MAIN_STRAINER)
 
     # 1. Target Content
     article = soup.find("article", role="main") or soup.find("div", role="main")
     if not article:
-        return
+        return []
 
-    # Extract Base URL from Canonical Link
+    # Extract Base URL from Canonical Link (lives in <head>, outside the strained soup)
     base_url = ""
-    canonical = soup.find("link", attrs={"rel": "canonical"})
+    canonical = CANONICAL_RE.search(html)
     if canonical:
-        base_url = canonical.get("href", "").replace("/current/", "/4.5/")
+        href = HREF_RE.search(canonical.group(0))
+        if href:
+            base_url = href.group(1).replace("/current/", "/4.5/")
 
     # 2. Find all definitions (Flat Search)
     definitions = article.find_all("dl", class_=lambda c: c and c.startswith("py"))
@@ -37,6 +78,7 @@ def parse_html_file(file_path):
     # Pre-calculate file ID for main topic detection
     file_id = os.path.splitext(os.path.basename(file_path))[0]
 
+    entities = []
     for dl in definitions:
         entity = {}
         
@@ -82,30 +124,7 @@ def parse_html_file(file_path):
         
         # If this entity is the main topic of the page
         if entity["id"] == file_id:
-            curr = dl.previous_sibling
-            while curr:
-                if isinstance(curr, NavigableString):
-                    curr = curr.previous_sibling
-                    continue
-                
-                tag_name = curr.name
-                if tag_name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'dl']:
-                    break # Stop at headers or other definitions
-                
-                # Capture Description
-                if tag_name == 'p':
-                    text = clean_text(curr.get_text())
-                    if text: intro_desc.insert(0, text)
-                
-                # Capture Code
-                elif tag_name == 'div' and ('highlight' in curr.get('class', []) or curr.find('div', class_='highlight')):
-                     pres = curr.find_all('pre')
-                     for pre in reversed(pres):
-                         intro_code.insert(0, pre.get_text())
-                elif tag_name == 'pre':
-                     intro_code.insert(0, curr.get_text())
-                
-                curr = curr.previous_sibling
+            intro_desc, intro_code = collect_intro(dl)
 
         # 5. Description & Code Extraction (Safe Logic)
         dd = dl.find("dd")
@@ -113,23 +132,24 @@ def parse_html_file(file_path):
         code_examples = []
         
         if dd:
+            field_list = None
             for child in dd.children:
-                if child.name == 'dl' and 'py' in child.get('class', []):
-                    continue
-                
-                if child.name == 'dl' and 'field-list' in child.get('class', []):
+                tag_name = child.name
+
+                # Nested definitions are entities of their own; the field list is parsed below
+                if tag_name == 'dl':
+                    if field_list is None and 'field-list' in child.get('class', []):
+                        field_list = child
                     continue
 
                 # Code Block Extraction
-                if child.name == 'pre':
+                if tag_name == 'pre':
                     code_examples.append(child.get_text())
                 
-                elif child.name == 'div':
-                    pres = child.find_all('pre')
+                elif tag_name == 'div':
+                    pres = [d.get_text() for d in child.descendants if d.name == 'pre']
                     if pres:
-                        for pre in pres:
-                            code_examples.append(pre.get_text())
-                        continue
+                        code_examples.extend(pres)
                     else:
                         text = clean_text(child.get_text())
                         if text: description_parts.append(text)
@@ -138,16 +158,15 @@ def parse_html_file(file_path):
                 elif isinstance(child, NavigableString):
                     text = str(child).strip()
                     if text: description_parts.append(text)
-                elif child.name in ['p', 'ul', 'ol', 'div', 'span']:
+                elif tag_name in TEXT_TAGS:
                     text = clean_text(child.get_text())
                     if text: description_parts.append(text)
 
             # Combine Intro + Main Content
-            entity["description"] = " ".join(intro_desc + description_parts)
+            entity["description"] = " ".join(chain(intro_desc, description_parts))
             entity["code_examples"] = intro_code + code_examples
 
             # 6. Structured Fields
-            field_list = dd.find("dl", class_="field-list")
             if field_list:
                 current_field = None
                 
@@ -162,13 +181,11 @@ def parse_html_file(file_path):
                         elif "return" in current_field:
                             entity["return_type"] = field_text
                         elif "param" in current_field:
-                            params = []
                             ul = child.find("ul")
                             if ul:
-                                for li in ul.find_all("li"):
-                                    params.append(clean_text(li.get_text()))
+                                params = [clean_text(li.get_text()) for li in ul.find_all("li")]
                             else:
-                                params.append(field_text)
+                                params = [field_text]
                             
                             if "parameters" in entity:
                                 entity["parameters"].extend(params)
@@ -177,21 +194,29 @@ def parse_html_file(file_path):
                         
                         current_field = None
 
-        yield entity
+        entities.append(entity)
+
+    return entities
 
 def main():
-    if not os.path.exists(SRC_DIR):
-        logging.error(f"Source directory '{SRC_DIR}' not found.")
+    if not os.path.exists(SOURCE_DIR):
+        logging.error(f"Source directory '{SOURCE_DIR}' not found.")
         return
 
-    html_files = glob(os.path.join(SRC_DIR, "*.html"))
+    # Select relevant documents in memory rather than staging a copy of them on disk
+    html_files = [
+        path for path in glob(os.path.join(SOURCE_DIR, "*.html"))
+        if is_relevant(os.path.basename(path))
+    ]
     logging.info(f"Found {len(html_files)} HTML files to parse.")
     
+    # Parsing is CPU-bound, so fan files out across processes; writing stays in
+    # this process so the JSONL keeps the file order.
     count = 0
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as out_f:
-        for file_path in html_files:
-            for entity in parse_html_file(file_path):
-                out_f.write(json.dumps(entity, ensure_ascii=False) + "\n")
+    with open(OUTPUT_FILE, "wb") as out_f, ProcessPoolExecutor() as executor:
+        for entities in executor.map(parse_html_file, html_files, chunksize=8):
+            for entity in entities:
+                out_f.write(orjson.dumps(entity, option=orjson.OPT_APPEND_NEWLINE))
                 count += 1
                     
     logging.info(f"Parsed {count} API entities. Saved to {OUTPUT_FILE}")
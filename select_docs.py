@@ -1,6 +1,7 @@
 import os
 import shutil
 import fnmatch
+import re
 
 SOURCE_DIR = "blender_python_reference_4_5"
 TARGET_DIR = "selected_blender_docs"
@@ -32,18 +33,16 @@ EXCLUDE_PATTERNS = [
     "_*", # Exclude internal/private modules or static files often starting with _
 ]
 
+def compile_patterns(patterns):
+    """Combines glob patterns into a single regex so each filename is matched once."""
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+INCLUDE_RE = compile_patterns(INCLUDE_PATTERNS)
+EXCLUDE_RE = compile_patterns(EXCLUDE_PATTERNS)
+
 def is_relevant(filename):
-    # First check exclusions
-    for pattern in EXCLUDE_PATTERNS:
-        if fnmatch.fnmatch(filename, pattern):
-            return False
-            
-    # Then check inclusions
-    for pattern in INCLUDE_PATTERNS:
-        if fnmatch.fnmatch(filename, pattern):
-            return True
-            
-    return False
+    # Exclusions take precedence over inclusions
+    return not EXCLUDE_RE.match(filename) and bool(INCLUDE_RE.match(filename))
 
 def main():
     if not os.path.exists(SOURCE_DIR):
@@ -55,21 +54,25 @@ def main():
     os.makedirs(TARGET_DIR)
 
     count = 0
-    files = os.listdir(SOURCE_DIR)
+    # scandir caches each entry's type, so no extra stat per file
+    with os.scandir(SOURCE_DIR) as it:
+        entries = list(it)
     
-    print(f"Scanning {len(files)} files in {SOURCE_DIR}...")
+    print(f"Scanning {len(entries)} files in {SOURCE_DIR}...")
     
-    for filename in files:
-        if is_relevant(filename):
-            src_path = os.path.join(SOURCE_DIR, filename)
-            dst_path = os.path.join(TARGET_DIR, filename)
+    for entry in entries:
+        # process only files, skip directories mostly unless we want to recurse (which we might not need for this flat list)
+        if entry.is_file() and is_relevant(entry.name):
+            dst_path = os.path.join(TARGET_DIR, entry.name)
             
-            # process only files, skip directories mostly unless we want to recurse (which we might not need for this flat list)
-            if os.path.isfile(src_path):
-                shutil.copy2(src_path, dst_path)
-                count += 1
+            # The parse step only reads these files, so a hardlink avoids copying any bytes
+            try:
+                os.link(entry.path, dst_path)
+            except OSError:
+                shutil.copy2(entry.path, dst_path) # e.g. source on another filesystem
+            count += 1
                 
-    print(f"Successfully copied {count} relevant documentation files to '{TARGET_DIR}'.")
+    print(f"Successfully selected {count} relevant documentation files to '{TARGET_DIR}'.")
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
@@ -9,6 +10,28 @@ load_dotenv()
 CHROMA_DB_DIR = "./chroma_db"
 COLLECTION_NAME = "blender_api"
 
+def search(vectorstore: Chroma, query: str):
+    print(f"Performing similarity search for: '{query}'")
+    results = vectorstore.similarity_search(query, k=1)
+    print_result(results)
+
+def search_many(vectorstore: Chroma, embeddings: OpenAIEmbeddings, queries):
+    # Embed every query in a single request, then search locally by vector
+    vectors = embeddings.embed_documents(queries)
+    for query, vector in zip(queries, vectors):
+        print(f"Performing similarity search for: '{query}'")
+        results = vectorstore.similarity_search_by_vector(vector, k=1)
+        print_result(results)
+
+def print_result(results):
+    if results:
+        print("\n--- Most Similar Result ---")
+        doc = results[0]
+        print(f"Content:\n{doc.page_content}")
+        print(f"\nMetadata:\n{doc.metadata}")
+    else:
+        print("No results found.")
+
 def main():
     # Check for API Key
     if not os.environ.get("OPENAI_API_KEY"):
@@ -28,17 +51,23 @@ def main():
     )
 
     # Perform Similarity Search
-    query = "particle system"
-    print(f"Performing similarity search for: '{query}'")
-    results = vectorstore.similarity_search(query, k=1)
+    # Queries given on the command line run in this one process; otherwise
+    # prompt interactively so the vector store is only loaded once.
+    queries = sys.argv[1:]
+    if queries:
+        search_many(vectorstore, embeddings, queries)
+        return
 
-    if results:
-        print("\n--- Most Similar Result ---")
-        doc = results[0]
-        print(f"Content:\n{doc.page_content}")
-        print(f"\nMetadata:\n{doc.metadata}")
-    else:
-        print("No results found.")
+    print("Enter a query (empty line or Ctrl-D to quit).")
+    while True:
+        try:
+            query = input("query> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+        if not query:
+            break
+        search(vectorstore, query)
 
 if __name__ == "__main__":
     main()